@@ -1,17 +1,45 @@
 from __future__ import annotations
-import os, json, re, time, traceback, logging
-from typing import Any, Dict, List
+import os, json, random, string, time, traceback, logging
+from itertools import islice
+from threading import Lock
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 
-from flask import Flask, request, jsonify, current_app
-from google import genai  # pip install google-genai>=0.1.0
+from cachetools import TTLCache  # pip install cachetools
+import fastjsonschema  # pip install fastjsonschema
+import xxhash  # pip install xxhash
 
-from policy import is_allowed  # your allowlist helper
+from flask import Flask, Response, request, current_app
+import orjson  # pip install orjson
+import httpx  # pip install httpx[http2]
+
+from policy import ENGINE as ALLOWLIST_ENGINE, is_allowed  # your allowlist helper
+from batcher import MicroBatcher
 
 APP_HOST = os.getenv("APP_HOST", "0.0.0.0")
 APP_PORT = int(os.getenv("APP_PORT", "8000"))
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta")
+GENAI_TIMEOUT = float(os.getenv("GENAI_TIMEOUT", "45"))  # seconds to wait on Gemini reads
+# Overall budget for one Gemini call, retries and backoff included; keep it under
+# the Jenkinsfile's curl --max-time 120 so no attempt outlives its caller.
+GENAI_DEADLINE = float(os.getenv("GENAI_DEADLINE", "100"))
+GENAI_RETRIES = int(os.getenv("GENAI_RETRIES", "3"))  # total attempts per Gemini call
+GENAI_BACKOFF = float(os.getenv("GENAI_BACKOFF", "0.75"))  # base delay, doubled per retry
+GENAI_BACKOFF_MAX = 30.0
+_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
 MAX_STAGES = int(os.getenv("MAX_STAGES", "12"))
 PLANNER_VERSION = os.getenv("PLANNER_VERSION", "planner-1.1.0")  # bump to verify new image
+CACHE_TTL_SEC = float(os.getenv("CACHE_TTL_SEC", "300"))  # 0 disables the plan cache
+CACHE_MAX = int(os.getenv("CACHE_MAX", "2048"))
+NEG_CACHE_TTL_SEC = float(os.getenv("NEG_CACHE_TTL_SEC", "60"))  # 0 disables failure caching
+NEG_CACHE_MAX = int(os.getenv("NEG_CACHE_MAX", "512"))
+# Micro-batching is off by default: a batch mixes contexts from different Jenkins
+# jobs into one prompt, so prompt injection in one job's commit message could
+# steer another job's plan. Only enable it when all callers are equally trusted.
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "0"))
+BATCH_MAX = int(os.getenv("BATCH_MAX", "8"))
+
+_log = logging.getLogger(__name__)  # for code that runs outside an app context (batcher threads)
 
 SAFE_FALLBACK_PLAN = {
     "stages": [
@@ -21,6 +49,13 @@ SAFE_FALLBACK_PLAN = {
     ]
 }
 
+_PLAN_RULES = """Rules:
+- At most %d stages.
+- Each 'name' is <= 40 chars, alnum/space/.- only.
+- Each 'command' is a SINGLE shell line (no multiline, no heredocs).
+- Prefer commonly available tools; avoid destructive ops and secrets.
+""" % MAX_STAGES
+
 JSON_SCHEMA_HINT = """
 Respond with STRICT JSON only (no markdown/code fences). The JSON must follow:
 {
@@ -29,32 +64,217 @@ Respond with STRICT JSON only (no markdown/code fences). The JSON must follow:
     { "name": "Test",  "command": "bash command here" }
   ]
 }
-Rules:
-- At most %d stages.
-- Each 'name' is <= 40 chars, alnum/space/.- only.
-- Each 'command' is a SINGLE shell line (no multiline, no heredocs).
-- Prefer commonly available tools; avoid destructive ops and secrets.
-""" % MAX_STAGES
+""" + _PLAN_RULES
+
+BATCH_SCHEMA_HINT = """
+Respond with STRICT JSON only (no markdown/code fences). The JSON must follow:
+{
+  "plans": [
+    { "id": "0", "stages": [ { "name": "Build", "command": "bash command here" } ] },
+    { "id": "1", "stages": [ { "name": "Test",  "command": "bash command here" } ] }
+  ]
+}
+There must be exactly one entry per context id. For each entry's stages:
+""" + _PLAN_RULES
+
+_FOCUS = """Focus:
+- If commit message mentions tests/docs only, skip heavy builds.
+- If branch is 'main' or 'release/*', include deploy (safe, idempotent commands).
+- Prefer commands commonly used by: Python, Node, Java, Go projects.
+- Keep commands one-liners compatible with 'sh'.
+- Avoid secrets/inline tokens."""
+
+# Static prompt pieces, built once; /plan only splices the context in between.
+_PROMPT_PREFIX = """You are a CI/CD planner that outputs STRICT JSON only.
+Given this Jenkins context:
+"""
+_PROMPT_SUFFIX = "\n\n" + JSON_SCHEMA_HINT + "\n\n" + _FOCUS
+
+_BATCH_PROMPT_PREFIX = """You are a CI/CD planner that outputs STRICT JSON only.
+Plan each of these independent Jenkins contexts separately:
+"""
+_BATCH_PROMPT_SUFFIX = "\n\n" + BATCH_SCHEMA_HINT + "\n\n" + _FOCUS
+
+# Gemini responseSchema (OpenAPI subset): with responseMimeType=application/json
+# the model is constrained to emit exactly this shape, no fences or prose.
+_STAGES_SCHEMA = {
+    "type": "ARRAY",
+    "maxItems": MAX_STAGES,
+    "items": {
+        "type": "OBJECT",
+        "properties": {"name": {"type": "STRING"}, "command": {"type": "STRING"}},
+        "required": ["name", "command"],
+        "propertyOrdering": ["name", "command"],
+    },
+}
+PLAN_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {"stages": _STAGES_SCHEMA},
+    "required": ["stages"],
+}
+BATCH_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "plans": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"id": {"type": "STRING"}, "stages": _STAGES_SCHEMA},
+                "required": ["id", "stages"],
+                "propertyOrdering": ["id", "stages"],
+            },
+        },
+    },
+    "required": ["plans"],
+}
+
+# JSON Schema for a parsed plan, code-generated into a plain Python function
+# once at import. Overlong plans/names are not rejected: the filter trims them.
+PLAN_JSON_SCHEMA = {
+    "type": "object",
+    "required": ["stages"],
+    "properties": {
+        "stages": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["name", "command"],
+                "properties": {"name": {"type": "string"}, "command": {"type": "string"}},
+            },
+        },
+    },
+}
+_validate_plan = fastjsonschema.compile(PLAN_JSON_SCHEMA)
+
+
+# Per-process plan cache keyed by the serialized context. TTLCache is bounded
+# (LRU eviction past CACHE_MAX) but not thread-safe, hence the lock.
+_plan_cache: Optional[TTLCache] = (
+    TTLCache(maxsize=CACHE_MAX, ttl=CACHE_TTL_SEC) if CACHE_TTL_SEC > 0 and CACHE_MAX > 0 else None
+)
+# Short-lived failure cache: a context whose Gemini call just failed gets the
+# fallback straight away instead of another round-trip (e.g. Jenkins retries).
+_neg_cache: Optional[TTLCache] = (
+    TTLCache(maxsize=NEG_CACHE_MAX, ttl=NEG_CACHE_TTL_SEC) if NEG_CACHE_TTL_SEC > 0 and NEG_CACHE_MAX > 0 else None
+)
+_cache_lock = Lock()
+
+
+def _dumps(obj: Any, option: int = 0) -> bytes:
+    # orjson rejects integers beyond 64 bits, which request JSON may still carry;
+    # stdlib json has no such limit, so fall back to it with matching output.
+    try:
+        return orjson.dumps(obj, option=option)
+    except orjson.JSONEncodeError:
+        indent = 2 if option & orjson.OPT_INDENT_2 else None
+        return json.dumps(
+            obj, ensure_ascii=False, indent=indent, sort_keys=bool(option & orjson.OPT_SORT_KEYS),
+            separators=(",", ": ") if indent else (",", ":"),
+        ).encode()
+
+
+def _ctx_key(ctx_json: bytes) -> str:
+    # Keying only, no need for a cryptographic hash.
+    return xxhash.xxh3_128_hexdigest(ctx_json)
+
+
+def _get_cached(key: str) -> Optional[Dict[str, Any]]:
+    if _plan_cache is None:
+        return None
+    with _cache_lock:
+        return _plan_cache.get(key)
+
+
+def _put_cache(key: str, plan: Dict[str, Any]) -> None:
+    if _plan_cache is None:
+        return
+    with _cache_lock:
+        _plan_cache[key] = plan
+
+
+def _get_failure(key: str) -> Optional[str]:
+    if _neg_cache is None:
+        return None
+    with _cache_lock:
+        return _neg_cache.get(key)
+
+
+def _put_failure(key: str, reason: str) -> None:
+    if _neg_cache is None:
+        return
+    with _cache_lock:
+        _neg_cache[key] = reason
+
+
+def _read_json_object(chunks: Iterable[str]) -> str:
+    """Join streamed text chunks up to the end of the first top-level JSON
+    object; later chunks (and text after the brace) are left unread."""
+    buf: List[str] = []
+    depth, in_str, escaped = 0, False, False
+    for text in chunks:
+        for i, ch in enumerate(text):
+            if in_str:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_str = False
+            elif ch == '"':
+                in_str = depth > 0
+            elif ch == "{":
+                depth += 1
+            elif ch == "}" and depth:
+                depth -= 1
+                if depth == 0:
+                    buf.append(text[:i + 1])
+                    return "".join(buf)
+        buf.append(text)
+    return "".join(buf)
 
 
 def _extract_json(maybe_json: str) -> str:
     if not isinstance(maybe_json, str):
         return "{}"
-    cleaned = re.sub(r"```(json)?", "", maybe_json, flags=re.IGNORECASE)
-    cleaned = cleaned.replace("```", "").strip()
-    m = re.search(r"\{[\s\S]*\}", cleaned)
-    return m.group(0) if m else cleaned
+    # First '{' to last '}' also drops any ```json fences around the object.
+    start = maybe_json.find("{")
+    end = maybe_json.rfind("}")
+    if start == -1 or end < start:
+        return maybe_json.replace("```json", "").replace("```", "").strip()
+    return maybe_json[start:end + 1]
+
+
+class _KeepTable(dict):
+    """str.translate table: allowed code points map to themselves, any
+    other code point (unicode included) is deleted."""
+    def __missing__(self, key: int) -> None:
+        return None
+
+
+_NAME_TABLE = _KeepTable((ord(c), ord(c)) for c in string.ascii_letters + string.digits + " ._-")
 
 
 def _sanitize_name(name: str) -> str:
-    return re.sub(r"[^a-zA-Z0-9 ._-]", "", name)[:40]
+    return name.translate(_NAME_TABLE)[:40]
+
+
+def _first_line(text: str) -> str:
+    line = text.partition("\n")[0]
+    # \r, \v, \x85, \u2028, ... are line breaks too (and non-printable);
+    # only then pay for splitlines().
+    if not line.isprintable():
+        line = (line.splitlines() or [""])[0]
+    return line
 
 
 def _postprocess_and_filter(plan: Dict[str, Any]) -> Dict[str, Any]:
+    # Raises fastjsonschema.JsonSchemaException on a malformed plan; the
+    # caller turns that into the safe fallback with an invalid_plan reason.
+    _validate_plan(plan)
     stages: List[Dict[str, str]] = []
-    for raw in plan.get("stages", [])[:MAX_STAGES]:
-        n = _sanitize_name(str(raw.get("name", "Stage")))
-        c = str(raw.get("command", "echo noop")).splitlines()[0].strip()
+    for raw in islice(plan["stages"], MAX_STAGES):
+        n = _sanitize_name(raw["name"])
+        c = _first_line(raw["command"]).strip()
         if not c:
             continue
         if is_allowed(c):
@@ -64,6 +284,133 @@ def _postprocess_and_filter(plan: Dict[str, Any]) -> Dict[str, Any]:
     return {"stages": stages}
 
 
+def _make_http_client(api_key: str) -> httpx.Client:
+    # One pooled HTTP/2 client per process: TLS + TCP setup is paid once and
+    # every later /plan call reuses the connection.
+    return httpx.Client(
+        http2=True,
+        base_url=GEMINI_API_BASE,
+        headers={"x-goog-api-key": api_key, "content-type": "application/json"},
+        limits=httpx.Limits(max_keepalive_connections=50),
+        timeout=httpx.Timeout(GENAI_TIMEOUT, connect=10.0),
+    )
+
+
+def _stream_text(client: httpx.Client, prompt: str, schema: Dict[str, Any], deadline: float) -> Iterator[str]:
+    """Yield the text deltas of a streamGenerateContent (SSE) response,
+    raising httpx.ReadTimeout once the monotonic `deadline` has passed."""
+    timeout = max(0.001, min(GENAI_TIMEOUT, deadline - time.monotonic()))
+    body = {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "generationConfig": {"responseMimeType": "application/json", "responseSchema": schema},
+    }
+    with client.stream(
+        "POST", f"/models/{GEMINI_MODEL}:streamGenerateContent",
+        params={"alt": "sse"}, content=orjson.dumps(body),
+        timeout=httpx.Timeout(timeout, connect=min(10.0, timeout)),
+    ) as resp:
+        if resp.is_error:
+            resp.read()  # keep Gemini's error status/message in the exception
+            raise httpx.HTTPStatusError(
+                f"HTTP {resp.status_code}: {resp.text[:500]}", request=resp.request, response=resp
+            )
+        for line in resp.iter_lines():
+            if time.monotonic() > deadline:
+                raise httpx.ReadTimeout("Gemini response exceeded GENAI_DEADLINE", request=resp.request)
+            if not line.startswith("data:"):
+                continue
+            event = orjson.loads(line[5:])
+            for cand in (event.get("candidates") or ())[:1]:
+                for part in (cand.get("content") or {}).get("parts") or ():
+                    if part.get("text"):
+                        yield part["text"]
+
+
+def _is_retriable(e: Exception) -> bool:
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code in _RETRY_STATUSES
+    if isinstance(e, httpx.ReadTimeout):
+        return False  # Gemini is still generating; another attempt only doubles the wait
+    return isinstance(e, httpx.TransportError)  # connect timeouts, resets, refused connects
+
+
+def _generate_text(client: httpx.Client, prompt: str, schema: Dict[str, Any]) -> str:
+    """Stream one Gemini completion, retrying overload/transient errors with
+    exponential backoff plus jitter; anything else fails fast. All attempts
+    share one GENAI_DEADLINE."""
+    deadline = time.monotonic() + GENAI_DEADLINE
+    last_err: Optional[Exception] = None
+    for attempt in range(max(1, GENAI_RETRIES)):
+        if attempt:
+            delay = min(GENAI_BACKOFF_MAX, GENAI_BACKOFF * (2 ** attempt)) + random.uniform(0, GENAI_BACKOFF)
+            if time.monotonic() + delay >= deadline:
+                break  # no time left for another attempt
+            time.sleep(delay)
+        try:
+            stream = _stream_text(client, prompt, schema, deadline)
+            try:
+                text = _read_json_object(stream)
+                # Read the stream to its end: httpcore sends no RST_STREAM for an
+                # early close, so Gemini would keep generating, and the unread DATA
+                # frames would shrink the shared connection's flow-control window.
+                # With responseSchema the object is the whole answer anyway.
+                try:
+                    for _ in stream:
+                        pass
+                except httpx.HTTPError:
+                    pass  # the plan is complete; a stalled tail must not discard it
+                return text
+            finally:
+                stream.close()
+        except Exception as e:
+            last_err = e
+            _log.warning("Gemini attempt %d failed: %s", attempt + 1, e)
+            if not _is_retriable(e):
+                break
+    raise last_err
+
+
+def _json_response(obj: Any, status: int = 200) -> Response:
+    # orjson emits UTF-8 bytes directly; skips jsonify's provider lookup.
+    return Response(_dumps(obj), status=status, mimetype="application/json")
+
+
+def _parse_plan_json(text: str) -> Any:
+    # Structured output is plain JSON; only dig through fences/prose if not.
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return orjson.loads(_extract_json(text).strip())
+
+
+def _plan_one(client: httpx.Client, ctx_json: bytes) -> Dict[str, Any]:
+    text = _generate_text(client, _PROMPT_PREFIX + ctx_json.decode() + _PROMPT_SUFFIX, PLAN_RESPONSE_SCHEMA)
+    return _parse_plan_json(text)
+
+
+def _plan_batch(client: httpx.Client, ctx_jsons: List[bytes]) -> List[Any]:
+    """MicroBatcher handler: plan several contexts with a single Gemini call.
+
+    Returns one raw plan per context, in order. A context missing from the
+    batched answer gets None, and its caller then plans it on its own request
+    thread: those fallbacks run concurrently and never hold up the others.
+    """
+    if len(ctx_jsons) == 1:
+        return [_plan_one(client, ctx_jsons[0])]
+
+    prompt = _BATCH_PROMPT_PREFIX + "".join(
+        f"\n[context id={i}]\n{c.decode()}\n" for i, c in enumerate(ctx_jsons)
+    ) + _BATCH_PROMPT_SUFFIX
+    text = _generate_text(client, prompt, BATCH_RESPONSE_SCHEMA)
+    try:
+        plans = _parse_plan_json(text).get("plans") or []
+        by_id = {str(p.get("id")): p for p in plans if isinstance(p, dict)}
+    except (orjson.JSONDecodeError, AttributeError):
+        by_id = {}
+
+    return [by_id.get(str(i)) for i in range(len(ctx_jsons))]
+
+
 def make_app() -> Flask:
     app = Flask(__name__)
 
@@ -79,12 +426,15 @@ def make_app() -> Flask:
     if not api_key:
         raise RuntimeError("GEMINI_API_KEY must be set")
 
-    client = genai.Client(api_key=api_key)
-    app.config["GENAI_CLIENT"] = client
+    app.config["GENAI_CLIENT"] = _make_http_client(api_key)
+    app.config["PLAN_BATCHER"] = (
+        MicroBatcher(lambda items: _plan_batch(app.config["GENAI_CLIENT"], items), BATCH_WINDOW_MS / 1000.0, BATCH_MAX)
+        if BATCH_WINDOW_MS > 0 and BATCH_MAX > 1 else None
+    )
 
     @app.get("/")
     def root():
-        return jsonify({
+        return _json_response({
             "ok": True,
             "endpoints": ["/healthz", "/plan", "/echo"],
             "model": GEMINI_MODEL,
@@ -93,21 +443,23 @@ def make_app() -> Flask:
 
     @app.get("/healthz")
     def healthz():
-        return jsonify({"ok": True, "model": GEMINI_MODEL, "version": PLANNER_VERSION})
+        return _json_response({
+            "ok": True, "model": GEMINI_MODEL, "version": PLANNER_VERSION, "allowlist_engine": ALLOWLIST_ENGINE
+        })
 
     @app.post("/echo")
     def echo():
         data = request.get_json(silent=True)
-        return jsonify({"received": data, "version": PLANNER_VERSION}), 200
+        return _json_response({"received": data, "version": PLANNER_VERSION})
 
     # Absolute last-resort error handler: ensure HTTP 200 with fallback
     @app.errorhandler(Exception)
     def _catch_all(e: Exception):
         current_app.logger.exception("Global errorhandler caught: %s", e)
-        return jsonify({
+        return _json_response({
             "stages": SAFE_FALLBACK_PLAN["stages"],
             "meta": {"fallback": True, "reason": f"global_handler: {e}", "version": PLANNER_VERSION}
-        }), 200
+        })
 
     @app.post("/plan")
     def plan():
@@ -117,71 +469,54 @@ def make_app() -> Flask:
         try:
             ctx = request.get_json(silent=True) or {}
 
-            prompt = f"""
-You are a CI/CD planner that outputs STRICT JSON only.
-Given this Jenkins context:
-{json.dumps(ctx, indent=2)}
-
-{JSON_SCHEMA_HINT}
-
-Focus:
-- If commit message mentions tests/docs only, skip heavy builds.
-- If branch is 'main' or 'release/*', include deploy (safe, idempotent commands).
-- Prefer commands commonly used by: Python, Node, Java, Go projects.
-- Keep commands one-liners compatible with 'sh'.
-- Avoid secrets/inline tokens.
-""".strip()
-
-            client: genai.Client = current_app.config["GENAI_CLIENT"]
-
-            # Small retry for transient 503/overload
-            last_err = None
-            for delay in (0.0, 1.5, 3.0):
-                if delay:
-                    time.sleep(delay)
-                try:
-                    # IMPORTANT: do NOT pass timeout=
-                    resp = client.models.generate_content(
-                        model=GEMINI_MODEL,
-                        contents=prompt
-                    )
-
-                    text = getattr(resp, "text", None)
-                    if not text:
-                        try:
-                            cand0 = (resp.candidates or [])[0]
-                            part0 = getattr(cand0, "content", None)
-                            if part0 and getattr(part0, "parts", None):
-                                text = part0.parts[0].text
-                        except Exception:
-                            text = ""
-
-                    raw_json = _extract_json(text).strip()
-                    plan_dict = json.loads(raw_json)
-                    filtered = _postprocess_and_filter(plan_dict)
-                    return jsonify(filtered), 200
-
-                except Exception as e:
-                    last_err = e
-                    msg = str(e)
-                    current_app.logger.warning("Gemini attempt failed: %s", msg)
-                    if "UNAVAILABLE" not in msg and "503" not in msg:
-                        break
-
-            # If all attempts fail, return safe fallback (still 200)
-            current_app.logger.exception("Gemini call failed after retries: %s", last_err)
-            return jsonify({
-                "stages": SAFE_FALLBACK_PLAN["stages"],
-                "meta": {"fallback": True, "reason": f"gemini_error: {last_err}", "version": PLANNER_VERSION}
-            }), 200
+            ctx_json = _dumps(ctx, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS)
+            key = _ctx_key(ctx_json)
+            cached = _get_cached(key)
+            if cached is not None:
+                return _json_response(cached)
+            failed = _get_failure(key)
+            if failed is not None:
+                return _json_response({
+                    "stages": SAFE_FALLBACK_PLAN["stages"],
+                    "meta": {"fallback": True, "reason": failed, "cached": True, "version": PLANNER_VERSION}
+                })
+
+            client: httpx.Client = current_app.config["GENAI_CLIENT"]
+            batcher: Optional[MicroBatcher] = current_app.config["PLAN_BATCHER"]
+            try:
+                plan_dict = batcher.submit(ctx_json) if batcher is not None else None
+                if plan_dict is None:  # unbatched, or missing from the batched answer
+                    plan_dict = _plan_one(client, ctx_json)
+                filtered = _postprocess_and_filter(plan_dict)
+            except fastjsonschema.JsonSchemaException as e:
+                # Gemini answered, but not with a usable plan; not a transport failure.
+                current_app.logger.warning("Gemini returned an invalid plan: %s", e)
+                reason = f"invalid_plan: {e}"
+                _put_failure(key, reason)
+                return _json_response({
+                    "stages": SAFE_FALLBACK_PLAN["stages"],
+                    "meta": {"fallback": True, "reason": reason, "version": PLANNER_VERSION}
+                })
+            except Exception as e:
+                # If all attempts fail, return safe fallback (still 200)
+                current_app.logger.exception("Gemini call failed after retries: %s", e)
+                reason = f"gemini_error: {e}"
+                _put_failure(key, reason)
+                return _json_response({
+                    "stages": SAFE_FALLBACK_PLAN["stages"],
+                    "meta": {"fallback": True, "reason": reason, "version": PLANNER_VERSION}
+                })
+
+            _put_cache(key, filtered)
+            return _json_response(filtered)
 
         except Exception as e:
             current_app.logger.exception("Unhandled /plan error")
-            return jsonify({
+            return _json_response({
                 "stages": SAFE_FALLBACK_PLAN["stages"],
                 "meta": {"fallback": True, "reason": f"unhandled: {e}", "version": PLANNER_VERSION,
                          "trace": traceback.format_exc()[:1200]}
-            }), 200
+            })
 
     return app
 
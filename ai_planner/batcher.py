@@ -0,0 +1,67 @@
+from __future__ import annotations
+import queue, threading, time
+from typing import Any, Callable, List, Optional
+
+
+class _Job:
+    __slots__ = ("item", "done", "result", "error")
+
+    def __init__(self, item: Any):
+        self.item = item
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class MicroBatcher:
+    """Coalesce concurrent submit() calls into one handler() call.
+
+    The first queued item opens a window of `window_sec`; everything that
+    arrives within it (up to `max_items`) is handed to `handler` as a list.
+    The handler returns one entry per item, in order; an exception instance
+    in that list fails only the corresponding submit(). Batches run on their
+    own thread so a slow handler never holds up the next window.
+    """
+
+    def __init__(self, handler: Callable[[List[Any]], List[Any]], window_sec: float, max_items: int):
+        self._handler = handler
+        self._window_sec = window_sec
+        self._max_items = max_items
+        self._queue: "queue.Queue[_Job]" = queue.Queue()
+        threading.Thread(target=self._collect, name="micro-batcher", daemon=True).start()
+
+    def submit(self, item: Any) -> Any:
+        job = _Job(item)
+        self._queue.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _collect(self) -> None:
+        while True:
+            jobs = [self._queue.get()]
+            deadline = time.monotonic() + self._window_sec
+            while len(jobs) < self._max_items:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    jobs.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            threading.Thread(target=self._dispatch, args=(jobs,), daemon=True).start()
+
+    def _dispatch(self, jobs: List[_Job]) -> None:
+        try:
+            results = self._handler([j.item for j in jobs])
+            if len(results) != len(jobs):
+                raise RuntimeError(f"batch handler returned {len(results)} results for {len(jobs)} items")
+        except Exception as e:
+            results = [e] * len(jobs)
+        for job, res in zip(jobs, results):
+            if isinstance(res, BaseException):
+                job.error = res
+            else:
+                job.result = res
+            job.done.set()
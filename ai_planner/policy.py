@@ -1,7 +1,17 @@
 
 from __future__ import annotations
-import os, re
-from typing import List, Dict
+import os, re, string, logging
+from typing import Any, Callable, List, Dict, Optional
+
+try:  # pip install google-re2: linear-time matching, no catastrophic backtracking
+    import re2 as _engine
+except ImportError:  # fall back to the stdlib backtracking engine
+    _engine = re
+
+try:  # native RegexSet matcher, built from ./policy_rs with maturin
+    from policy_rs import Matcher as _NativeMatcher
+except ImportError:
+    _NativeMatcher = None
 
 # Named allowlist sets. Keep them tight.
 ALLOWLIST_SETS: Dict[str, List[str]] = {
@@ -77,13 +87,117 @@ ALLOWLIST_SETS: Dict[str, List[str]] = {
     ],
 }
 
-def compile_allowlist(patterns: List[str]) -> List[re.Pattern]:
-    return [re.compile(p) for p in patterns]
+MAX_CMD_LENGTH = int(os.getenv("MAX_CMD_LENGTH", "500"))
+
+_LITERAL_CHARS = frozenset(string.ascii_letters + string.digits + "_-")
+
+def _has_top_level_alternation(pattern: str) -> bool:
+    depth, in_class, escaped = 0, False, False
+    for ch in pattern:
+        if escaped:
+            escaped = False
+        elif ch == "\\":
+            escaped = True
+        elif in_class:
+            in_class = ch != "]"
+        elif ch == "[":
+            in_class = True
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "|" and depth == 0:
+            return True
+    return False
+
+def _strip_anchors(pattern: str) -> str:
+    """Turn a ^...$ pattern into its body for use with fullmatch()."""
+    if pattern.startswith("^"):
+        pattern = pattern[1:]
+    body = pattern[:-1]
+    if pattern.endswith("$") and (len(body) - len(body.rstrip("\\"))) % 2 == 0:
+        return body
+    return pattern + ".*"  # no end anchor: keep match()'s prefix semantics
+
+def _literal_head(pattern: str) -> str:
+    """Literal text every full match of `pattern` starts with ('' if none)."""
+    if _has_top_level_alternation(pattern):
+        return ""
+    head = []
+    for i in range(len(pattern)):
+        ch = pattern[i]
+        if ch not in _LITERAL_CHARS or pattern[i + 1:i + 2] in ("?", "*", "{"):
+            break
+        head.append(ch)
+    return "".join(head)
+
+# Python's \s on ASCII text. RE2 leaves out \v and \x1c-\x1f (the regex crate
+# leaves out \x1c-\x1f), so \s is spelled out before handing patterns to them.
+_PY_ASCII_SPACE = "\\t\\n\\x0b\\f\\r \\x1c-\\x1f"
 
-def load_active_allowlist() -> List[re.Pattern]:
+def _ascii_whitespace(pattern: str) -> str:
+    out, in_class, escaped = [], False, False
+    for ch in pattern:
+        if escaped:
+            escaped = False
+            if ch == "s":
+                out.append(_PY_ASCII_SPACE if in_class else f"[{_PY_ASCII_SPACE}]")
+            elif ch == "S" and not in_class:
+                out.append(f"[^{_PY_ASCII_SPACE}]")
+            else:
+                out.append("\\" + ch)
+            continue
+        if ch == "\\":
+            escaped = True
+            continue
+        if in_class:
+            in_class = ch != "]"
+        elif ch == "[":
+            in_class = True
+        out.append(ch)
+    return "".join(out)
+
+def _bucket(bodies: List[str], compile: Callable[[str], Any]) -> Dict[str, Any]:
+    # Bucket patterns by their literal head ("git", "pytest", ...) and compile
+    # each bucket into one alternation, so a command only runs against the
+    # one or two buckets whose head it starts with.
+    buckets: Dict[str, List[str]] = {}
+    for p in bodies:
+        buckets.setdefault(_literal_head(p), []).append(p)
+    return {
+        head: compile("|".join(f"(?:{p})" for p in pats))
+        for head, pats in buckets.items()
+    }
+
+def compile_allowlist(patterns: List[str], ascii_only: bool = False) -> Dict[str, Any]:
+    r"""Compile patterns into head buckets for is_allowed.
+
+    With ascii_only=True the result is only ever run on ASCII commands, which
+    lets it use the native RegexSet or RE2. Neither matches Python's `re` on
+    non-ASCII text: RE2's \b, \w, \d and \s are ASCII-only (so "echoé" would
+    pass echo\b.*), and the regex crate uses different Unicode tables. The
+    mismatch goes both ways. On ASCII text they agree with `re` once \s is
+    spelled out, so non-ASCII commands always use the stdlib `re` buckets.
+    """
+    bodies = list(dict.fromkeys(map(_strip_anchors, patterns)))
+    if not ascii_only:
+        return _bucket(bodies, re.compile)
+    fast = [_ascii_whitespace(p) for p in bodies]
+    if _NativeMatcher is not None:
+        # A single RegexSet already scans every pattern in one pass; keep it
+        # under the '' head so is_allowed probes it for every command.
+        try:
+            return {"": _NativeMatcher(fast)}
+        except ValueError:
+            pass  # syntax the regex crate rejects: use the Python engines
+    if _engine is re:
+        return _bucket(bodies, re.compile)
+    return _bucket(fast, _engine.compile)
+
+def load_active_allowlist(ascii_only: bool = False) -> Optional[Dict[str, Any]]:
     mode = os.getenv("ALLOWLIST_MODE", "strict").strip().lower()
     if mode == "off":
-        return []
+        return None
     selected = [s.strip() for s in os.getenv("ALLOWLIST", "base").split(",") if s.strip()]
     patterns: List[str] = []
     for key in selected:
@@ -91,14 +205,41 @@ def load_active_allowlist() -> List[re.Pattern]:
     # Always include harmless echo as a baseline
     if r"^echo\b.*$" not in patterns:
         patterns.append(r"^echo\b.*$")
-    return compile_allowlist(patterns)
+    return compile_allowlist(patterns, ascii_only)
+
+def _head_lengths(allowlist: Optional[Dict[str, Any]]) -> List[int]:
+    # Distinct head lengths to probe; cmd[:n] is the only key a bucket could match.
+    return sorted({len(h) for h in allowlist or ()})
+
+def _engine_name(allowlist: Optional[Dict[str, Any]]) -> str:
+    if allowlist is None:
+        return "off"
+    if _NativeMatcher is not None and isinstance(allowlist.get(""), _NativeMatcher):
+        return "policy_rs"
+    return _engine.__name__  # "re2" or "re"
+
+ACTIVE_ALLOWLIST = load_active_allowlist(ascii_only=True)
+ACTIVE_HEAD_LENGTHS = _head_lengths(ACTIVE_ALLOWLIST)
+# Engine that matches ASCII commands; non-ASCII ones always use stdlib `re`.
+ENGINE = _engine_name(ACTIVE_ALLOWLIST)
+logging.getLogger(__name__).info("allowlist engine: %s", ENGINE)
+# stdlib `re` buckets for commands with non-ASCII characters
+ACTIVE_UNICODE_ALLOWLIST = load_active_allowlist()
+ACTIVE_UNICODE_HEAD_LENGTHS = _head_lengths(ACTIVE_UNICODE_ALLOWLIST)
 
-ACTIVE_ALLOWLIST = load_active_allowlist()
+def _matches(allowlist: Dict[str, Any], head_lengths: List[int], cmd: str) -> bool:
+    for n in head_lengths:
+        bucket = allowlist.get(cmd[:n])
+        if bucket is not None and bucket.fullmatch(cmd):
+            return True
+    return False
 
 def is_allowed(command: str) -> bool:
-    if not ACTIVE_ALLOWLIST:  # 'off' mode
+    if ACTIVE_ALLOWLIST is None:  # 'off' mode
         return True
     cmd = command.strip()
-    if len(cmd) > int(os.getenv("MAX_CMD_LENGTH", "500")):
+    if len(cmd) > MAX_CMD_LENGTH:
         return False
-    return any(p.match(cmd) for p in ACTIVE_ALLOWLIST)
+    if cmd.isascii():
+        return _matches(ACTIVE_ALLOWLIST, ACTIVE_HEAD_LENGTHS, cmd)
+    return _matches(ACTIVE_UNICODE_ALLOWLIST, ACTIVE_UNICODE_HEAD_LENGTHS, cmd)
@@ -0,0 +1,35 @@
+//! Native allowlist matcher for `policy.py`.
+//!
+//! A `RegexSet` compiles every pattern into a single automaton, so a command
+//! is checked against the whole allowlist in one linear-time pass.
+
+use pyo3::exceptions::PyValueError;
+use pyo3::prelude::*;
+use regex::RegexSet;
+
+#[pyclass(frozen)]
+struct Matcher {
+    set: RegexSet,
+}
+
+#[pymethods]
+impl Matcher {
+    /// Build from pattern bodies (no `^`/`$`); each must match the whole string.
+    #[new]
+    fn new(patterns: Vec<String>) -> PyResult<Self> {
+        RegexSet::new(patterns.iter().map(|p| format!("^(?:{p})$")))
+            .map(|set| Matcher { set })
+            .map_err(|e| PyValueError::new_err(e.to_string()))
+    }
+
+    /// True if any pattern matches all of `text`.
+    fn fullmatch(&self, text: &str) -> bool {
+        self.set.is_match(text)
+    }
+}
+
+#[pymodule]
+fn policy_rs(m: &Bound<'_, PyModule>) -> PyResult<()> {
+    m.add_class::<Matcher>()?;
+    Ok(())
+}
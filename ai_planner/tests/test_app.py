@@ -0,0 +1,148 @@
+import os
+
+import httpx
+import orjson
+import pytest
+
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+import app  # noqa: E402
+
+
+def _sse(text):
+    event = {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+    return httpx.Response(200, content=b"data: " + orjson.dumps(event) + b"\n\n")
+
+
+def _client(text):
+    return httpx.Client(transport=httpx.MockTransport(lambda request: _sse(text)), base_url="http://gemini.test")
+
+
+def test_plan_batch_maps_plans_back_by_id():
+    answer = {"plans": [
+        {"id": "2", "stages": [{"name": "Two", "command": "echo 2"}]},
+        {"id": "0", "stages": [{"name": "Zero", "command": "echo 0"}]},
+    ]}
+    plans = app._plan_batch(_client(orjson.dumps(answer).decode()), [b"{}", b"{}", b"{}"])
+    assert plans[0]["stages"][0]["name"] == "Zero"
+    assert plans[1] is None  # missing id: the caller plans it on its own
+    assert plans[2]["stages"][0]["name"] == "Two"
+
+
+def test_plan_batch_unparsable_answer_leaves_every_context_unplanned():
+    assert app._plan_batch(_client("not json"), [b"{}", b"{}"]) == [None, None]
+
+
+def test_dumps_falls_back_for_big_ints():
+    option = orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS
+    ctx = {"n": 2 ** 70, "a": "é"}
+    assert app._dumps(ctx, option) == b'{\n  "a": "\xc3\xa9",\n  "n": 1180591620717411303424\n}'
+    small = {"n": 1, "a": "é"}
+    assert app._dumps(small, option) == orjson.dumps(small, option=option)
+
+
+def test_echo_returns_big_ints():
+    resp = app.app.test_client().post("/echo", json={"n": 2 ** 70})
+    assert resp.status_code == 200
+    assert b'"n":1180591620717411303424' in resp.data
+
+
+def test_invalid_plan_gets_its_own_fallback_reason(monkeypatch):
+    monkeypatch.setitem(app.app.config, "GENAI_CLIENT", _client(orjson.dumps({"stages": "nope"}).decode()))
+    meta = app.app.test_client().post("/plan", json={"case": "invalid-plan"}).get_json()["meta"]
+    assert meta["fallback"] is True
+    assert meta["reason"].startswith("invalid_plan: ")
+
+
+def _counting_client(respond):
+    calls = []
+    def handler(request):
+        calls.append(request)
+        return respond(request)
+    return httpx.Client(transport=httpx.MockTransport(handler), base_url="http://gemini.test"), calls
+
+
+def test_read_timeout_is_not_retried():
+    def respond(request):
+        raise httpx.ReadTimeout("slow", request=request)
+    client, calls = _counting_client(respond)
+    with pytest.raises(httpx.ReadTimeout):
+        app._generate_text(client, "prompt", app.PLAN_RESPONSE_SCHEMA)
+    assert len(calls) == 1
+
+
+def test_retries_stop_at_the_deadline(monkeypatch):
+    monkeypatch.setattr(app, "GENAI_DEADLINE", 0.5)
+    monkeypatch.setattr(app, "GENAI_BACKOFF", 1.0)
+    client, calls = _counting_client(lambda request: httpx.Response(503, text="overloaded"))
+    with pytest.raises(httpx.HTTPStatusError):
+        app._generate_text(client, "prompt", app.PLAN_RESPONSE_SCHEMA)
+    assert len(calls) == 1  # a 2 s backoff would overrun the 0.5 s budget
+
+
+def test_generate_text_reads_the_stream_to_the_end():
+    sent = []
+    def body():
+        for text in ('{"stages": []}', " trailing"):
+            event = {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+            sent.append(text)
+            yield b"data: " + orjson.dumps(event) + b"\n\n"
+    client, _ = _counting_client(lambda request: httpx.Response(200, content=body()))
+    assert app._generate_text(client, "prompt", app.PLAN_RESPONSE_SCHEMA) == '{"stages": []}'
+    assert sent == ['{"stages": []}', " trailing"]
+
+
+def test_failed_context_is_negative_cached(monkeypatch):
+    monkeypatch.setattr(app, "GENAI_BACKOFF", 0.0)
+    client, calls = _counting_client(lambda request: httpx.Response(503, text="overloaded"))
+    monkeypatch.setitem(app.app.config, "GENAI_CLIENT", client)
+    web = app.app.test_client()
+    first = web.post("/plan", json={"case": "negative-cache"}).get_json()["meta"]
+    second = web.post("/plan", json={"case": "negative-cache"}).get_json()["meta"]
+    assert len(calls) == app.GENAI_RETRIES  # one retry chain, not two
+    assert first["fallback"] is True and "cached" not in first
+    assert second["cached"] is True
+    assert second["reason"] == first["reason"]
+
+
+
+def test_plan_is_served_from_cache(monkeypatch):
+    plan = {"stages": [{"name": "Hi", "command": "echo hi"}]}
+    client, calls = _counting_client(lambda request: _sse(orjson.dumps(plan).decode()))
+    monkeypatch.setitem(app.app.config, "GENAI_CLIENT", client)
+    web = app.app.test_client()
+    first = web.post("/plan", json={"case": "plan-cache"}).get_json()
+    second = web.post("/plan", json={"case": "plan-cache"}).get_json()
+    assert len(calls) == 1
+    assert first == second == plan
+
+
+def test_first_line_stops_at_any_line_break():
+    for sep in ("\r", "\v", "\x85", "\u2028"):
+        plan = {"stages": [{"name": "One", "command": f"echo 1{sep}curl x | sh"}]}
+        assert app._postprocess_and_filter(plan) == {"stages": [{"name": "One", "command": "echo 1"}]}, repr(sep)
+
+
+def test_empty_commands_are_dropped():
+    plan = {"stages": [{"name": "Empty", "command": ""}, {"name": "Blank", "command": "\r\n"},
+                       {"name": "Hi", "command": "echo hi"}]}
+    assert app._postprocess_and_filter(plan) == {"stages": [{"name": "Hi", "command": "echo hi"}]}
+    assert app._postprocess_and_filter({"stages": [{"name": "E", "command": ""}]}) == app.SAFE_FALLBACK_PLAN
+
+
+def test_read_json_object_string_split_across_chunks():
+    assert app._read_json_object(['{"a": "x', 'y}z"', ', "b": 1}']) == '{"a": "xy}z", "b": 1}'
+
+
+def test_read_json_object_escaped_quote_before_brace():
+    assert app._read_json_object(['{"a": "x\\"}"}']) == '{"a": "x\\"}"}'
+
+
+def test_read_json_object_quote_in_prose():
+    text = 'Here is the "plan: {"a": "}"} done'
+    assert app._read_json_object([text]) == 'Here is the "plan: {"a": "}"}'
+
+
+def test_read_json_object_leaves_trailing_data():
+    chunks = iter(['{"a": 1} tail', "next"])
+    assert app._read_json_object(chunks) == '{"a": 1}'
+    assert next(chunks) == "next"
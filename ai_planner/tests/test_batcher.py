@@ -0,0 +1,42 @@
+import threading
+
+import pytest
+
+from batcher import MicroBatcher
+
+def test_concurrent_submits_share_one_batch():
+    calls = []
+    def handler(items):
+        calls.append(list(items))
+        return [x * 2 for x in items]
+    b = MicroBatcher(handler, window_sec=0.2, max_items=8)
+    out = {}
+    ts = [threading.Thread(target=lambda i=i: out.__setitem__(i, b.submit(i))) for i in range(4)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    assert out == {0: 0, 1: 2, 2: 4, 3: 6}
+    assert len(calls) == 1
+
+def test_exception_entry_fails_only_its_item():
+    batches = []
+    def handler(items):
+        batches.append(list(items))
+        return [ValueError("bad") if x == "bad" else x * 2 for x in items]
+    b = MicroBatcher(handler, window_sec=0.2, max_items=2)
+    out = {}
+    t = threading.Thread(target=lambda: out.__setitem__("ok", b.submit(21)))
+    t.start()
+    with pytest.raises(ValueError, match="bad"):
+        b.submit("bad")
+    t.join()
+    assert out == {"ok": 42}
+    assert len(batches) == 1 and sorted(map(str, batches[0])) == ["21", "bad"]
+
+def test_handler_failure_fails_every_item():
+    def handler(items):
+        raise RuntimeError("down")
+    b = MicroBatcher(handler, window_sec=0.0, max_items=1)
+    with pytest.raises(RuntimeError, match="down"):
+        b.submit("x")
@@ -1,3 +1,4 @@
+import pytest
 
 from policy import is_allowed
 
@@ -9,3 +10,78 @@ def test_disallow_long_cmd():
 
 def test_python_install_allowed():
     assert is_allowed("pip install -r requirements.txt")
+
+def test_literal_head():
+    from policy import _literal_head
+    assert _literal_head(r"git\s+status\b.*") == "git"
+    assert _literal_head(r"pip(\d+)?\s+install\s+.*") == "pip"
+    assert _literal_head(r"ab?c") == "a"
+    assert _literal_head(r"a|b") == ""
+
+def test_strip_anchors():
+    from policy import _strip_anchors
+    assert _strip_anchors(r"^pwd$") == "pwd"
+    assert _strip_anchors(r"^cost\$") == r"cost\$.*"
+    assert _strip_anchors(r"^git\b") == r"git\b.*"
+
+def test_word_boundary_before_non_ascii():
+    # re2's \b is ASCII-only; non-ASCII commands must keep Python re semantics.
+    assert not is_allowed("echoé")
+    assert is_allowed("echo é")
+
+def test_ascii_whitespace_matches_python_s():
+    import re
+    from policy import _ascii_whitespace
+    spelled = re.compile(_ascii_whitespace(r"\s"))
+    for c in map(chr, range(128)):
+        assert bool(spelled.fullmatch(c)) == bool(re.fullmatch(r"\s", c)), repr(c)
+
+class _StubMatcher:
+    # Same contract as policy_rs.Matcher: whole-string match against any pattern.
+    def __init__(self, patterns):
+        import re
+        self._patterns = [re.compile(p) for p in patterns]
+
+    def fullmatch(self, text):
+        return any(p.fullmatch(text) for p in self._patterns)
+
+def test_native_matcher_bucket(monkeypatch):
+    import policy
+    monkeypatch.setattr(policy, "_NativeMatcher", _StubMatcher)
+    allowlist = policy.compile_allowlist([r"^echo\b.*$", r"^git\s+status\b.*$"], ascii_only=True)
+    assert list(allowlist) == [""]
+    monkeypatch.setattr(policy, "ACTIVE_ALLOWLIST", allowlist)
+    monkeypatch.setattr(policy, "ACTIVE_HEAD_LENGTHS", policy._head_lengths(allowlist))
+    assert is_allowed("echo hello")
+    assert is_allowed("git  status")
+    assert not is_allowed("echoes")
+    assert not is_allowed("rm -rf /")
+
+def test_native_matcher_rejection_falls_back(monkeypatch):
+    import policy
+    def reject(patterns):
+        raise ValueError("unsupported syntax")
+    monkeypatch.setattr(policy, "_NativeMatcher", reject)
+    allowlist = policy.compile_allowlist([r"^echo\b.*$"], ascii_only=True)
+    assert list(allowlist) == ["echo"]
+
+def test_engine_reports_the_active_matcher():
+    import policy
+    assert policy.ENGINE in ("policy_rs", "re2", "re", "off")
+    assert policy._engine_name(None) == "off"
+    assert policy._engine_name({"echo": None}) == policy._engine.__name__
+
+def test_policy_rs_matcher_agrees_with_re():
+    import re
+    policy_rs = pytest.importorskip("policy_rs")
+    if not hasattr(policy_rs, "Matcher"):  # the unbuilt source dir, seen as a namespace package
+        pytest.skip("policy_rs is not built")
+    import policy
+    bodies = [policy._ascii_whitespace(policy._strip_anchors(p)) for p in policy.ALLOWLIST_SETS["base"]]
+    matcher = policy_rs.Matcher(bodies)
+    expected = [re.compile(b) for b in bodies]
+    for cmd in ["echo hi", "echoes", "true", "git  status", "git\\tstatus", "ls -la", "rm -rf /", ""]:
+        assert matcher.fullmatch(cmd) == any(p.fullmatch(cmd) for p in expected), cmd
+    with pytest.raises(ValueError):
+        policy_rs.Matcher(["("])
+    assert policy.ENGINE == "policy_rs"